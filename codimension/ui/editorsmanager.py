@@ -37,7 +37,7 @@ from utils.fileutils import (getFileProperties, isImageViewable,
                              getXmlSyntaxFileByMime, isFileSearchable)
 from utils.diskvaluesrelay import (getFilePosition, updateFilePosition,
                                    addRecentFile, getCollapsedGroups,
-                                   setCollapsedGroups)
+                                   setCollapsedGroups, batchRecentFilesSave)
 from utils.encoding import detectEolString
 from diagram.importsdgmgraphics import ImportDgmTabWidget
 from editor.vcsannotateviewer import VCSAnnotateViewerTabWidget
@@ -1817,8 +1817,10 @@ class EditorsManager(QTabWidget):
         if self.closeRequest():
             # It's safe to close all the tabs
             self.__doNotSaveTabs = True
-            while self.widget(0) != self.__welcomeWidget:
-                self.__onCloseRequest(0)
+            # Each closed tab updates the recent files list
+            with batchRecentFilesSave():
+                while self.widget(0) != self.__welcomeWidget:
+                    self.__onCloseRequest(0)
             self.__doNotSaveTabs = False
 
     def saveTabsStatus(self):
@@ -232,6 +232,14 @@ def getRecentFiles():
     return Settings().recentFiles
 
 
+def batchRecentFilesSave():
+    """Provides a context manager which collapses the recent files saves"""
+    project = GlobalData().project
+    if project.isLoaded():
+        return project.batchSave()
+    return Settings().batchSave()
+
+
 
 
 ##DebuggerEnvironment
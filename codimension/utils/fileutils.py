@@ -25,11 +25,18 @@ from os.path import (islink, exists, split, join, sep, basename, realpath,
                      normpath, isabs, dirname)
 import logging
 import json
+import shutil
 import magic
 import tempfile
 from errno import EACCES, ENOENT
 from ui.qt import QImageReader
 
+# orjson is optional; it is much faster than the standard json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Qutepart has a few maps which halp to map a file to a syntax.
 from qutepart import Qutepart
 
@@ -674,23 +681,100 @@ def isCDMProjectFile(fName):
     return 'x-codimension3' in mime
 
 
+def cloneProps(props):
+    """Provides a copy of a dict which values are strings or lists of them"""
+    # There is no need for the generic deepcopy() machinery for such dicts
+    return {key: list(value) if isinstance(value, list) else value
+            for key, value in props.items()}
+
+
+def withSep(path):
+    """Provides the path with a trailing separator"""
+    return path if path.endswith(sep) else path + sep
+
+
 # Utility functions to save/load generic JSON
+def encodeJSON(values, pretty=False):
+    """Provides the values serialized to JSON as bytes"""
+    # Pretty output is for the files edited by hand and kept under VCS so it
+    # is always produced by the standard module to stay byte identical
+    # regardless of whether orjson is installed. Compact output is for the
+    # internal files.
+    if pretty:
+        return json.dumps(values, indent=4).encode(DEFAULT_ENCODING)
+    if orjson is not None:
+        try:
+            return orjson.dumps(values, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson is stricter, e.g. it does not accept lone surrogates
+            # which non UTF-8 file names are decoded into
+            pass
+    return json.dumps(values,
+                      separators=(',', ':')).encode(DEFAULT_ENCODING)
+
+
+def decodeJSON(content):
+    """Provides the values deserialized from JSON bytes"""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except ValueError:
+            # orjson is stricter, e.g. it does not accept escaped lone
+            # surrogates which the standard module writes
+            pass
+    return json.loads(content)
+
+
 def loadJSON(fileName, errorWhat, defaultValue):
     """Generic JSON loading"""
     try:
-        with open(fileName, 'r', encoding=DEFAULT_ENCODING) as diskfile:
-            return json.load(diskfile)
+        with open(fileName, 'rb') as diskfile:
+            return decodeJSON(diskfile.read())
     except Exception as exc:
         logging.error('Error loading ' + errorWhat +
                       ' (from ' + fileName + '): ' + str(exc))
         return defaultValue
 
 
+# Files written by writeFileAtomically() and not synced to the disk yet
+__filesToSync = set()
+
+
+def writeFileAtomically(fileName, content):
+    """Replaces the file content with the given bytes in one step"""
+    # The content goes to a hidden temporary file first which is then renamed
+    # so a failure never leaves a truncated file. The hidden name keeps the
+    # project files watcher default filters from reporting it. fsync() is
+    # postponed till syncWrittenFiles() because the files are saved often.
+    tmpFileName = join(dirname(fileName), '.' + basename(fileName) + '.tmp')
+    try:
+        with open(tmpFileName, 'wb') as diskfile:
+            diskfile.write(content)
+        if exists(fileName):
+            shutil.copymode(fileName, tmpFileName)
+        os.replace(tmpFileName, fileName)
+    except Exception:
+        if exists(tmpFileName):
+            os.unlink(tmpFileName)
+        raise
+    __filesToSync.add(fileName)
+
+
+def syncWrittenFiles():
+    """Flushes the files written by writeFileAtomically() to the disk"""
+    while __filesToSync:
+        fileName = __filesToSync.pop()
+        try:
+            with open(fileName, 'rb') as diskfile:
+                os.fsync(diskfile.fileno())
+        except Exception as exc:
+            logging.error('Error syncing ' + fileName + ': ' + str(exc))
+
+
 def saveJSON(fileName, values, errorWhat):
     """Generic JSON saving"""
     try:
-        with open(fileName, 'w', encoding=DEFAULT_ENCODING) as diskfile:
-            json.dump(values, diskfile, indent=4)
+        writeFileAtomically(fileName, encodeJSON(values))
     except Exception as exc:
         logging.error('Error saving ' + errorWhat +
                       ' (to ' + fileName + '): ' + str(exc))
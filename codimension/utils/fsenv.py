@@ -20,8 +20,9 @@
 """Provides the storage for the file system environment"""
 
 import os.path
-from copy import deepcopy
-from .fileutils import loadJSON, saveJSON
+from collections import OrderedDict
+from contextlib import contextmanager
+from .fileutils import loadJSON, saveJSON, withSep, cloneProps
 
 
 # toplevel dirs: those which are added to the file system browser
@@ -39,25 +40,38 @@ class FileSystemEnvironment:
     """Loads/stores/saves the fs related environment"""
 
     def __init__(self):
-        self.__props = deepcopy(_DEFAULT_FS_PROPS)
+        self.__props = cloneProps(_DEFAULT_FS_PROPS)
         self.__fseFileName = None
 
+        # In-memory mirror of the top level dirs list for fast lookups
+        self.__topLevelDirSet = set()
+
+        # MRU ordered recent files; synced to the 'recent' list on save
+        self.__recentFiles = OrderedDict()
+
         # Default. Could be updated later.
         self.__limit = 32
 
+        # Nesting level of batchSave() and whether a save was postponed
+        self.__saveSuspendDepth = 0
+        self.__saveDirty = False
+
     def reset(self):
         """Resets the binding to the file system"""
-        self.__props = deepcopy(_DEFAULT_FS_PROPS)
+        # Postponed changes belong to the previous binding
+        if self.__saveDirty:
+            self.__save()
+        self.__props = cloneProps(_DEFAULT_FS_PROPS)
         self.__fseFileName = None
+        self.__topLevelDirSet = set()
+        self.__recentFiles = OrderedDict()
 
     def setup(self, dirName):
         """Binds the parameters to a disk file"""
         # Just in case - flush the previous data if they were bound
-        FileSystemEnvironment.save(self)
+        self.__save()
 
-        dirName = os.path.realpath(dirName)
-        if not dirName.endswith(os.path.sep):
-            dirName += os.path.sep
+        dirName = withSep(os.path.realpath(dirName))
         if not os.path.isdir(dirName):
             raise Exception('Directory name is expected for the file system '
                             'environment. The given ' + dirName + ' is not.')
@@ -69,16 +83,42 @@ class FileSystemEnvironment:
     def load(self):
         """Loads the saved file system environment"""
         if self.__fseFileName:
-            default = deepcopy(_DEFAULT_FS_PROPS)
-            self.__props = loadJSON(self.__fseFileName,
-                                    'file system environment', default)
+            # loadJSON() provides a freshly parsed dict, so the defaults are
+            # built only if loading failed
+            props = loadJSON(self.__fseFileName,
+                             'file system environment', None)
+            if props is None:
+                props = cloneProps(_DEFAULT_FS_PROPS)
+            self.__props = props
+            self.__topLevelDirSet = set(self.__props['topleveldirs'])
+            self.__recentFiles = OrderedDict.fromkeys(self.__props['recent'])
 
     def save(self):
         """Saves the file system environment into a file"""
+        if self.__saveSuspendDepth > 0:
+            self.__saveDirty = True
+            return
+        self.__save()
+
+    def __save(self):
+        """Unconditionally writes the environment to the bound file"""
+        self.__saveDirty = False
         if self.__fseFileName:
+            self.__props['recent'] = list(self.__recentFiles)
             saveJSON(self.__fseFileName, self.__props,
                      'file system environment')
 
+    @contextmanager
+    def batchSave(self):
+        """Collapses all the saves within the block into one at the end"""
+        self.__saveSuspendDepth += 1
+        try:
+            yield
+        finally:
+            self.__saveSuspendDepth -= 1
+            if self.__saveSuspendDepth == 0 and self.__saveDirty:
+                self.__save()
+
     def setLimit(self, newLimit):
         """Sets the new limit to the number of entries"""
         self.__limit = newLimit
@@ -96,30 +136,32 @@ class FileSystemEnvironment:
     @property
     def recentFiles(self):
         """Provides the recently used files list"""
-        return self.__props['recent']
+        return list(self.__recentFiles)
 
     @recentFiles.setter
     def recentFiles(self, files):
-        self.__props['recent'] = files
+        self.__recentFiles = OrderedDict.fromkeys(files)
         FileSystemEnvironment.save(self)
 
     def addRecentFile(self, path):
         """Adds a single recent file. True if a new file was inserted."""
-        if path in self.__props['recent']:
-            self.__props['recent'].remove(path)
-            self.__props['recent'].insert(0, path)
+        recent = self.__recentFiles
+        if path in recent:
+            recent.move_to_end(path, last=False)
             FileSystemEnvironment.save(self)
             return False
-        self.__props['recent'].insert(0, path)
-        if len(self.__props['recent']) > self.__limit:
-            self.__props['recent'] = self.__props['recent'][0:self.__limit]
+        recent[path] = None
+        recent.move_to_end(path, last=False)
+        limit = self.__limit
+        while len(recent) > limit:
+            recent.popitem(last=True)
         FileSystemEnvironment.save(self)
         return True
 
     def removeRecentFile(self, path):
         """Removes a single recent file"""
-        if path in self.__props['recent']:
-            self.__props['recent'].remove(path)
+        if path in self.__recentFiles:
+            del self.__recentFiles[path]
             FileSystemEnvironment.save(self)
 
     @property
@@ -140,20 +182,26 @@ class FileSystemEnvironment:
     @topLevelDirs.setter
     def topLevelDirs(self, newDirs):
         self.__props['topleveldirs'] = newDirs
+        self.__topLevelDirSet = set(newDirs)
         FileSystemEnvironment.save(self)
 
     def addTopLevelDir(self, path):
         """Adds a top level dir"""
-        if not path.endswith(os.path.sep):
-            path += os.path.sep
-        if path not in self.__props['topleveldirs']:
+        path = withSep(path)
+        if path not in self.__topLevelDirSet:
+            self.__topLevelDirSet.add(path)
             self.__props['topleveldirs'].append(path)
             FileSystemEnvironment.save(self)
 
     def removeTopLevelDir(self, path):
         """Removes a top level dir"""
-        if not path.endswith(os.path.sep):
-            path += os.path.sep
-        if path in self.__props['topleveldirs']:
+        path = withSep(path)
+        if path in self.__topLevelDirSet:
+            self.__topLevelDirSet.remove(path)
             self.__props['topleveldirs'].remove(path)
             FileSystemEnvironment.save(self)
+
+    def isTopLevelDir(self, path):
+        """Checks if the path is a top level dir"""
+        path = withSep(path)
+        return path in self.__topLevelDirSet
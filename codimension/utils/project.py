@@ -23,16 +23,18 @@
 import logging
 import uuid
 import re
-import copy
-import json
 import shutil
 import os
-from os.path import (realpath, islink, isdir, sep, exists, dirname, isabs,
+from functools import lru_cache
+from os.path import (realpath, isdir, sep, exists, dirname, isabs,
                      join, relpath)
 from ui.qt import QObject, pyqtSignal
 from .settings import Settings, SETTINGS_DIR
 from .watcher import Watcher
 from .config import DEFAULT_ENCODING
+from .fileutils import (encodeJSON, decodeJSON, withSep, loadJSON,
+                        saveJSON, writeFileAtomically, cloneProps,
+                        syncWrittenFiles)
 from .debugenv import DebuggerEnvironment
 from .searchenv import SearchEnvironment
 from .fsenv import FileSystemEnvironment
@@ -56,6 +58,12 @@ _DEFAULT_PROJECT_PROPS = {'scriptname': '',    # Script to run the project
                           'encoding': ''}
 
 
+# Top level string fields of a project file which are shown in a tooltip
+_TOOLTIP_FIELDS_REGEXP = re.compile(
+    rb'"(version|description|author|email|copyright|license|creationdate|'
+    rb'encoding|uuid)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
 class CodimensionProject(QObject,
                          DebuggerEnvironment,
                          SearchEnvironment,
@@ -92,18 +100,43 @@ class CodimensionProject(QObject,
         # Avoid pylint complains
         self.fileName = ""
         self.userProjectDir = ""    # Directory in ~/.codimension3/uuidNN/
+        self.__projectDir = None    # Cached getProjectDir() value
+        self.__lastSavedContent = None
+        self.__lastSavedStamp = None
+        self.__filesListCache = None
+        self.__filesListCacheDirty = False
         self.filesList = set()
 
-        self.props = copy.deepcopy(_DEFAULT_PROJECT_PROPS)
+        self.props = cloneProps(_DEFAULT_PROJECT_PROPS)
 
         # Precompile the exclude filters for the project files list
-        self.__excludeFilter = []
+        self.__excludeFilters = []
         for flt in Settings()['projectFilesFilters']:
-            self.__excludeFilter.append(re.compile(flt))
+            self.__excludeFilters.append(re.compile(flt))
+        self.__excludeFilter = self.__combineFilters(self.__excludeFilters)
+
+    @staticmethod
+    def __combineFilters(filters):
+        """Provides a single alternation regexp for the filters if possible"""
+        # Inline global flags and group references do not survive being
+        # joined with other patterns so such filters are matched one by one
+        defaultFlags = re.compile('').flags
+        for flt in filters:
+            if flt.groups > 0 or flt.flags != defaultFlags:
+                return None
+        if not filters:
+            return None
+        try:
+            return re.compile('|'.join('(?:' + flt.pattern + ')'
+                                       for flt in filters))
+        except re.error:
+            return None
 
     def shouldExclude(self, name):
         """Tests if a file must be excluded"""
-        for excl in self.__excludeFilter:
+        if self.__excludeFilter is not None:
+            return self.__excludeFilter.match(name) is not None
+        for excl in self.__excludeFilters:
             if excl.match(name):
                 return True
         return False
@@ -114,13 +147,18 @@ class CodimensionProject(QObject,
         # created. This must be an absolute path.
         self.fileName = ""
         self.userProjectDir = ""
+        self.__projectDir = None
+        self.__lastSavedContent = None
+        self.__lastSavedStamp = None
+        self.__filesListCache = None
+        self.__filesListCacheDirty = False
 
         # Generated having the project dir Full paths are stored.
         # The set holds all files and directories.
         # The dirs end with os.path.sep
         self.filesList = set()
 
-        self.props = copy.deepcopy(_DEFAULT_PROJECT_PROPS)
+        self.props = cloneProps(_DEFAULT_PROJECT_PROPS)
 
         RunParametersCache.reset(self)
         DebuggerEnvironment.reset(self)
@@ -158,6 +196,7 @@ class CodimensionProject(QObject,
         self.__resetValues()
 
         self.fileName = fileName
+        self.__projectDir = dirname(realpath(fileName)) + sep
         props['uuid'] = projectUuid
         self.props = props
         self.userProjectDir = userProjectDir
@@ -175,6 +214,7 @@ class CodimensionProject(QObject,
         self.__generateFilesList()
 
         self.saveProject()
+        self.__flushFilesListCache()
 
         # Update the watcher
         self.__dirWatcher = Watcher(Settings()['projectFilesFilters'],
@@ -185,17 +225,9 @@ class CodimensionProject(QObject,
 
     def __removeProjectFiles(self, userProjectDir):
         """Removes user project files"""
-        for root, dirs, files in os.walk(userProjectDir):
-            for f in files:
-                try:
-                    os.unlink(join(root, f))
-                except Exception:
-                    pass
-            for d in dirs:
-                try:
-                    shutil.rmtree(join(root, d))
-                except Exception:
-                    pass
+        # Errors are ignored as before: the files will be overwritten anyway
+        shutil.rmtree(userProjectDir, ignore_errors=True)
+        os.makedirs(userProjectDir, exist_ok=True)
 
     def __createProjectFile(self):
         """Helper function to create the user project file"""
@@ -212,23 +244,43 @@ class CodimensionProject(QObject,
         if not self.isLoaded():
             return
 
-        # It could be another user project file without write permissions
+        # The project file could be edited by hand and kept under VCS so it
+        # stays indented
+        content = encodeJSON(self.props, pretty=True)
+
+        # No need to rewrite the file if nothing has changed since the last
+        # save neither in memory nor on disk
+        if content == self.__lastSavedContent:
+            if self.__getProjectFileStamp() == self.__lastSavedStamp:
+                return
+
+        # It could be another user project file without write permissions.
+        # The file is replaced atomically so the dir must be writable too.
         skipProjectFile = False
         if exists(self.fileName):
             if not os.access(self.fileName, os.W_OK):
                 skipProjectFile = True
-        else:
-            if not os.access(dirname(self.fileName), os.W_OK):
-                skipProjectFile = True
+        if not os.access(dirname(self.fileName), os.W_OK):
+            skipProjectFile = True
 
         if not skipProjectFile:
-            with open(self.fileName, 'w',
-                      encoding=DEFAULT_ENCODING) as diskfile:
-                json.dump(self.props, diskfile, indent=4)
+            projectDirMTime = self.__getProjectDirMTime()
+            writeFileAtomically(self.fileName, content)
+            self.__lastSavedContent = content
+            self.__lastSavedStamp = self.__getProjectFileStamp()
+            self.__onProjectFileWritten(projectDirMTime)
         else:
             logging.warning('Skipping updates in ' + self.fileName +
                             ' due to writing permissions')
 
+    def __getProjectFileStamp(self):
+        """Provides the project file mtime and size or None"""
+        try:
+            stat = os.stat(self.fileName)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
     def loadProject(self, projectFile):
         """Loads a project from the given file"""
         path = realpath(projectFile)
@@ -239,14 +291,15 @@ class CodimensionProject(QObject,
                             'Expected: .cdm3')
 
         try:
-            with open(path, 'r', encoding=DEFAULT_ENCODING) as diskfile:
-                props = json.load(diskfile)
+            with open(path, 'rb') as diskfile:
+                props = decodeJSON(diskfile.read())
         except:
             # Bad error - cannot load project file at all
             raise Exception('Bad project file ' + projectFile)
 
         self.__resetValues()
         self.fileName = path
+        self.__projectDir = dirname(path) + sep
         self.props = props
 
         if self.props['uuid'] == '':
@@ -269,6 +322,7 @@ class CodimensionProject(QObject,
         # The project might have been moved...
         self.__createProjectFile()  # ~/.codimension3/uuidNN/project
         self.__generateFilesList()
+        self.__flushFilesListCache()
 
         # Update the recent list
         Settings().addRecentProject(self.fileName)
@@ -284,11 +338,12 @@ class CodimensionProject(QObject,
     def getImportDirsAsAbsolutePaths(self):
         """Provides a list of import dirs as absolute paths"""
         result = []
+        projectDir = self.getProjectDir()
         for path in self.props['importdirs']:
             if isabs(path):
                 result.append(path)
             else:
-                result.append(self.getProjectDir() + path)
+                result.append(projectDir + path)
         return result
 
     def onFSChanged(self, items):
@@ -307,6 +362,7 @@ class CodimensionProject(QObject,
         """Unloads the current project if required"""
         self.sigProjectAboutToUnload.emit()
         self.__resetValues()
+        syncWrittenFiles()
         if emitSignal:
             # No need to send a signal e.g. if IDE is closing
             self.sigProjectChanged.emit(self.CompleteProject)
@@ -321,43 +377,147 @@ class CodimensionProject(QObject,
     def __generateFilesList(self):
         """Generates the files list having the list of dirs"""
         self.filesList = set()
+        if self.__loadFilesListCache():
+            return
+
         path = self.getProjectDir()
         self.filesList.add(path)
-        self.__scanDir(path)
-
-    def __scanDir(self, path):
-        """Recursive function to scan one dir"""
-        # The path is with '/' at the end
-        for item in os.listdir(path):
-            if self.shouldExclude(item):
-                continue
-
-            # Exclude symlinks if they point to the other project
-            # covered pieces
-            candidate = path + item
-            if islink(candidate):
-                realItem = realpath(candidate)
-                if isdir(realItem):
-                    if self.isProjectDir(realItem):
-                        continue
-                else:
-                    if self.isProjectDir(dirname(realItem)):
+        dirMTimes = {}
+        symlinks = {}
+        self.__scanDir(path, dirMTimes, symlinks)
+        self.__filesListCache = {
+            'projectdir': path,
+            'filters': Settings()['projectFilesFilters'],
+            'dirs': dirMTimes,
+            'symlinks': symlinks,
+            'files': [item for item in self.filesList
+                      if not item.endswith(sep)]}
+        self.__filesListCacheDirty = True
+
+    def __getFilesListCacheFileName(self):
+        """Provides the files list cache file name"""
+        return self.userProjectDir + 'fileslist.json'
+
+    def __loadFilesListCache(self):
+        """Restores the files list from the cache if it is up to date"""
+        # Any added, removed or renamed item updates its parent dir mtime,
+        # so the cache is valid if none of the scanned dirs mtimes differ.
+        # A dir modified within the same timestamp tick as the cache was
+        # written could have changed unnoticed so such dirs are dirty.
+        # Symlinks could be re-pointed somewhere else without touching the
+        # scanned dirs so their targets are checked separately.
+        fileName = self.__getFilesListCacheFileName()
+        if not exists(fileName):
+            return False
+        cache = loadJSON(fileName, 'project files list cache', None)
+        try:
+            cacheMTime = os.stat(fileName).st_mtime_ns
+            if cache['projectdir'] != self.getProjectDir():
+                return False
+            if cache['filters'] != Settings()['projectFilesFilters']:
+                return False
+            for path, mtime in cache['dirs'].items():
+                if mtime >= cacheMTime:
+                    return False
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            for path, (target, isDir) in cache['symlinks'].items():
+                if realpath(path) != target or isdir(path) != isDir:
+                    return False
+            filesList = set(cache['dirs'])
+            filesList.update(cache['files'])
+        except Exception:
+            return False
+        self.filesList = filesList
+        self.__filesListCache = cache
+        return True
+
+    def __flushFilesListCache(self):
+        """Saves the files list cache if it was updated"""
+        if self.__filesListCacheDirty:
+            self.__filesListCacheDirty = False
+            saveJSON(self.__getFilesListCacheFileName(),
+                     self.__filesListCache, 'project files list cache')
+
+    def __getProjectDirMTime(self):
+        """Provides the project dir mtime or None"""
+        try:
+            return os.stat(self.getProjectDir()).st_mtime_ns
+        except OSError:
+            return None
+
+    def __onProjectFileWritten(self, projectDirMTime):
+        """Accounts the project file save in the files list cache"""
+        # Saving the project file changes the project dir mtime. If nothing
+        # else changed the dir since it was scanned then the cache stays
+        # valid with the new mtime.
+        cache = self.__filesListCache
+        if cache is None:
+            return
+        projectDir = self.getProjectDir()
+        if cache['dirs'].get(projectDir) != projectDirMTime:
+            self.__filesListCache = None
+            self.__filesListCacheDirty = False
+            return
+        cache['dirs'][projectDir] = self.__getProjectDirMTime()
+        if self.fileName not in cache['files']:
+            cache['files'].append(self.fileName)
+        self.__filesListCacheDirty = True
+        self.__flushFilesListCache()
+
+    def __scanDir(self, path, dirMTimes, symlinks):
+        """Scans the dir and all its subdirs"""
+        # The paths are with '/' at the end. The dir entries carry the file
+        # type from the directory read so most of the items need no stat().
+        # The dir mtime is taken before reading so that concurrent changes
+        # invalidate the files list cache. The symlinks targets are collected
+        # for the cache validation too.
+        # The loop is hot for big projects so the attributes lookups are
+        # done once here.
+        shouldExclude = self.shouldExclude
+        projectDir = self.getProjectDir()
+        addItem = self.filesList.add
+        stat = os.stat
+        scandir = os.scandir
+
+        dirsToScan = [path]
+        addDir = dirsToScan.append
+        while dirsToScan:
+            path = dirsToScan.pop()
+            dirMTimes[path] = stat(path).st_mtime_ns
+            with scandir(path) as entries:
+                for entry in entries:
+                    item = entry.name
+                    if shouldExclude(item):
                         continue
 
-            if isdir(candidate):
-                self.filesList.add(candidate + sep)
-                self.__scanDir(candidate + sep)
-                continue
-            self.filesList.add(candidate)
+                    # Exclude symlinks if they point to the other project
+                    # covered pieces. is_dir() follows the link with a single
+                    # stat() and caches the result for the check below. The
+                    # resolved path needs no further realpath() so it is
+                    # checked against the project dir directly.
+                    candidate = path + item
+                    if entry.is_symlink():
+                        realItem = realpath(candidate)
+                        symlinks[candidate] = (realItem, entry.is_dir())
+                        if not entry.is_dir():
+                            realItem = dirname(realItem)
+                        if withSep(realItem).startswith(projectDir):
+                            continue
+
+                    if entry.is_dir():
+                        candidate += sep
+                        addItem(candidate)
+                        addDir(candidate)
+                        continue
+                    addItem(candidate)
 
     def isProjectDir(self, path):
         """Returns True if the path belongs to the project"""
         if not self.isLoaded():
             return False
-        path = realpath(path)     # it could be a symlink
-        if not path.endswith(sep):
-            path += sep
-        return path.startswith(self.getProjectDir())
+        # it could be a symlink
+        return withSep(realpath(path)).startswith(self.getProjectDir())
 
     def isProjectFile(self, path):
         """Returns True if the path belongs to the project"""
@@ -365,12 +525,6 @@ class CodimensionProject(QObject,
             return False
         return self.isProjectDir(dirname(path))
 
-    def isTopLevelDir(self, path):
-        """Checks if the path is a top level dir"""
-        if not path.endswith(sep):
-            path += sep
-        return path in self.topLevelDirs
-
     def updateProperties(self, props):
         """Updates the project properties"""
         if self.props != props:
@@ -381,6 +535,7 @@ class CodimensionProject(QObject,
     def onProjectFileUpdated(self):
         """Called when a project file is updated via direct editing"""
         self.props = getProjectProperties(self.fileName)
+        self.__lastSavedContent = None
 
         # no need to save, but signal just in case
         self.sigProjectChanged.emit(self.Properties)
@@ -391,9 +546,8 @@ class CodimensionProject(QObject,
 
     def getProjectDir(self):
         """Provides an absolute path to the project dir"""
-        if not self.isLoaded():
-            return None
-        return dirname(realpath(self.fileName)) + sep
+        # None if the project is not loaded
+        return self.__projectDir
 
     def getProjectScript(self):
         """Provides the project script file name"""
@@ -427,24 +581,61 @@ class CodimensionProject(QObject,
         return path
 
 
-def getProjectProperties(projectFile):
-    """Provides project properties or throws an exception"""
+@lru_cache(maxsize=64)
+def _readProjectProperties(path, mtime):
+    """Memoized project file parsing; the mtime invalidates stale entries"""
+    with open(path, 'rb') as diskfile:
+        return decodeJSON(diskfile.read())
+
+
+@lru_cache(maxsize=64)
+def _readProjectTooltipFields(path, mtime):
+    """Memoized extraction of the tooltip fields without full parsing"""
+    with open(path, 'rb') as diskfile:
+        content = diskfile.read()
+
+    fields = {}
+    for match in _TOOLTIP_FIELDS_REGEXP.finditer(content):
+        # The value is decoded as a JSON string to handle escapes
+        fields[match.group(1).decode(DEFAULT_ENCODING)] = \
+            decodeJSON(b'"' + match.group(2) + b'"')
+    if not fields:
+        # Unexpected layout; let the JSON parser deal with it
+        return _readProjectProperties(path, mtime)
+    return fields
+
+
+def _getSharedProjectProperties(projectFile, reader=_readProjectProperties):
+    """Provides the memoized project properties; must not be modified"""
     path = realpath(projectFile)
-    if not exists(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
         raise Exception("Cannot find project file " + projectFile)
 
     try:
-        with open(path, 'r', encoding=DEFAULT_ENCODING) as diskfile:
-            return json.load(diskfile)
+        return reader(path, mtime)
     except Exception as exc:
         logging.error('Error reading project file ' + projectFile +
                       ': ' + str(exc))
         return {}
 
 
+def getProjectProperties(projectFile):
+    """Provides project properties or throws an exception"""
+    # The memoized dict is shared so the caller gets its own copy
+    return cloneProps(_getSharedProjectProperties(projectFile))
+
+
+def getProjectTooltipFields(fileName):
+    """Provides the project properties shown in a tooltip"""
+    return dict(_getSharedProjectProperties(fileName,
+                                            _readProjectTooltipFields))
+
+
 def getProjectFileTooltip(fileName):
     """Provides a project file tooltip"""
-    props = getProjectProperties(fileName)
+    props = getProjectTooltipFields(fileName)
     return '\n'.join(['Version: ' + props.get('version', 'n/a'),
                       'Description: ' + props.get('description', 'n/a'),
                       'Author: ' + props.get('author', 'n/a'),
@@ -98,11 +98,11 @@ class SearchEnvironment:
 
     def __addToContainer(self, element, item):
         """Common implementation of adding a search item"""
-        if item in self.__props[element]:
-            self.__props[element].remove(item)
-        self.__props[element].insert(0, item)
-        if len(self.__props[element]) > self.__limit:
-            self.__props[element] = self.__props[element][0:self.__limit]
+        container = self.__props[element]
+        if item in container:
+            container.remove(item)
+        container.insert(0, item)
+        del container[self.__limit:]
         SearchEnvironment.save(self)
 
     def __setContainer(self, item, history):